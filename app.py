@@ -5,13 +5,25 @@
 # ------------------------------------------------------
 
 import os
-import io
+import json
 import requests
+import numpy as np
 import pandas as pd
 import streamlit as st
 from time import time
 from datetime import datetime, timedelta
 
+try:
+    import orjson  # optional, 2-5x faster decode than pd.read_json
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+try:
+    import ijson  # optional, streaming parse for very large files
+except ImportError:
+    ijson = None
+
 # -----------------------------
 # CONFIG
 # -----------------------------
@@ -21,12 +33,22 @@ CACHE_TTL_SEC = int(os.getenv("CACHE_TTL_SEC", "600"))  # 10 min
 MAX_ONLINE_HOURS = 12
 
 # GitHub Raw URL (Streamlit Cloud → Secrets)
+# .get() → a missing key is not an exception; only a missing secrets.toml is
 try:
-    GITHUB_RAW_URL = st.secrets["GITHUB_RAW_URL"]
+    GITHUB_RAW_URL = st.secrets.get("GITHUB_RAW_URL", "")
 except Exception:
     GITHUB_RAW_URL = ""
+GITHUB_RAW_URL = GITHUB_RAW_URL or os.getenv("GITHUB_RAW_URL", "")
 
 JSON_PATH = os.getenv("SHIFTS_JSON_PATH", "user_status_dashboard.json")
+# Local JSON above this size is stream-parsed (needs ijson)
+STREAM_JSON_MIN_BYTES = int(os.getenv("STREAM_JSON_MIN_BYTES", str(64 * 1024 * 1024)))
+
+# Only fields the dashboard reads (streaming loader drops the rest)
+EVENT_FIELDS = (
+    "user_id", "name", "event", "datetime_iso", "sort_key",
+    "note", "is_at_approved_location",
+)
 
 # -----------------------------
 # PAGE SETUP
@@ -41,25 +63,64 @@ if st.sidebar.button("Reload data"):
 # -----------------------------
 # DATA LOADERS
 # -----------------------------
-@st.cache_data(ttl=CACHE_TTL_SEC, show_spinner=False)
+def records_to_df(raw: bytes) -> pd.DataFrame:
+    """
+    JSON array of event records → DataFrame (no pd.read_json type sniffing)
+    """
+    return pd.DataFrame.from_records(_json_loads(raw))
+
+
+def stream_records_to_df(path: str) -> pd.DataFrame:
+    """
+    Stream-parse a large JSON array keeping only EVENT_FIELDS
+    (peak memory ~ used columns, not the whole decoded blob)
+    """
+    cols = {k: [] for k in EVENT_FIELDS}
+    seen = set()
+    with open(path, "rb") as f:
+        for rec in ijson.items(f, "item"):
+            seen.update(k for k in rec if k in cols)
+            for k, values in cols.items():
+                values.append(rec.get(k))
+    # Keys never present → no column, same as the non-streaming path
+    # (present-but-null keys still get their all-null column)
+    return pd.DataFrame({k: v for k, v in cols.items() if k in seen})
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_session() -> requests.Session:
+    """
+    One pooled session per server process (keeps TCP+TLS alive across reruns)
+    """
+    session = requests.Session()
+    session.headers.update({
+        "Accept": "application/json",
+        "User-Agent": "streamlit-app",
+    })
+    return session
+
+
 def fetch_json_from_github(url: str, bucket: int) -> pd.DataFrame:
     headers = {
         "Cache-Control": "no-cache",
         "Pragma": "no-cache",
-        "Accept": "application/json",
-        "User-Agent": "streamlit-app",
     }
     full_url = f"{url}?v={bucket}"
-    r = requests.get(full_url, headers=headers, timeout=30)
+    r = get_http_session().get(full_url, headers=headers, timeout=30)
     r.raise_for_status()
-    return pd.read_json(io.StringIO(r.text))
+    return records_to_df(r.content)
 
 
-@st.cache_data(ttl=CACHE_TTL_SEC, show_spinner=False)
-def load_local_json(path: str) -> pd.DataFrame:
+def load_events(path: str) -> pd.DataFrame:
     if not os.path.exists(path):
-        raise FileNotFoundError(f"JSON not found: {path}")
-    return pd.read_json(path)
+        raise FileNotFoundError(f"Data file not found: {path}")
+    if path.endswith(".parquet"):
+        # Typed columns, datetimes arrive tz-aware → no string parsing
+        return pd.read_parquet(path, engine="pyarrow")
+    if ijson is not None and os.path.getsize(path) > STREAM_JSON_MIN_BYTES:
+        return stream_records_to_df(path)
+    with open(path, "rb") as f:
+        return records_to_df(f.read())
 
 # -----------------------------
 # HELPERS
@@ -68,17 +129,23 @@ def parse_datetime_columns(df: pd.DataFrame) -> pd.DataFrame:
     if "datetime_iso" not in df.columns:
         raise KeyError("Expected datetime_iso column")
 
-    dt = pd.to_datetime(df["datetime_iso"], errors="coerce", utc=True)
-    df["datetime"] = dt.dt.tz_convert(IST_TZ)
-    return df.dropna(subset=["datetime"]).copy()
+    col = df["datetime_iso"]
+    if isinstance(col.dtype, pd.DatetimeTZDtype):  # e.g. Parquet source
+        already_ist = str(col.dt.tz) == IST_TZ
+        df["datetime"] = col if already_ist else col.dt.tz_convert(IST_TZ)
+    else:
+        dt = pd.to_datetime(col, errors="coerce", utc=True, format="ISO8601")
+        df["datetime"] = dt.dt.tz_convert(IST_TZ)
+    return df.dropna(subset=["datetime"])
 
 
-def apply_window(df: pd.DataFrame):
+@st.cache_data(max_entries=2, show_spinner=False)
+def _window_bounds(today_iso: str):
     """
-    Friday -> Today window, inclusive of the *entire* current day
+    Friday -> Today window, inclusive of the *entire* current day.
+    Memoized per IST date, so it rolls over exactly at midnight.
     """
-    now_ist = pd.Timestamp.now(tz=IST_TZ)
-    today_start = now_ist.floor("D")
+    today_start = pd.Timestamp(today_iso, tz=IST_TZ)
     weekday = today_start.weekday()  # Mon=0, Fri=4
 
     days_back_to_friday = (weekday - 4) % 7
@@ -96,107 +163,214 @@ def apply_window(df: pd.DataFrame):
         else today_start + pd.Timedelta(days=1)
     )
 
-    mask = (
-        df["datetime"] >= last_friday
-    ) & (
-        df["datetime"] < window_end
+    return (
+        last_friday.to_datetime64(),
+        window_end.to_datetime64(),
+        last_friday.date(),
+        (window_end - pd.Timedelta(days=1)).date(),
     )
 
-    return df.loc[mask], last_friday.date(), (window_end - pd.Timedelta(days=1)).date()
+
+def apply_window(df: pd.DataFrame, today_iso: str):
+    """
+    Slice df (sorted ascending by datetime) to the Friday -> Today window
+    """
+    lo_dt, hi_dt, start_d, end_d = _window_bounds(today_iso)
+
+    # Binary-search the bounds on the raw UTC buffer
+    vals = df["datetime"].values
+    lo = np.searchsorted(vals, lo_dt, side="left")
+    hi = np.searchsorted(vals, hi_dt, side="left")
+
+    return df.iloc[lo:hi], start_d, end_d
+
+
+def latest_per_user(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Newest event per user, newest first (grouped argmax, no full sort)
+    """
+    idx = df.groupby("user_id", observed=True, sort=False)["datetime"].idxmax()
+    return df.loc[idx].sort_values("datetime", ascending=False)
 
 # -----------------------------
-# LOAD DATA
+# TRANSFORM (cached per data version)
 # -----------------------------
-try:
-    if GITHUB_RAW_URL:
-        bucket = int(time() // CACHE_TTL_SEC)
-        raw_df = fetch_json_from_github(GITHUB_RAW_URL, bucket)
-        data_source = "GitHub Raw"
+ACTIVE_EVENTS = {"Punch In", "Break Start", "Break End"}
+STATUS_MAP = {
+    "Punch In": "🟢 active",
+    "Break Start": "🟠 on break",
+    "Break End": "🟢 active",
+    "Punch Out": "🔴 on leave",  # → "🟡 left for the day" if note/today
+    "On Leave": "🔴 on leave",
+}
+# Raw fields build_df reads / columns it hands to the per-rerun view code
+TRANSFORM_INPUTS = (
+    "user_id", "name", "event", "datetime", "note", "is_at_approved_location",
+)
+VIEW_COLUMNS = [
+    "user_id", "datetime", "name", "status", "last_out",
+    "Work mode", "Date", "event", "Time",
+]
+
+
+@st.cache_data(ttl=CACHE_TTL_SEC, show_spinner=False)
+def build_df(source: str, version: float):
+    """
+    Load + derive all display columns once per data version
+    (GitHub: cache bucket, local file: mtime). Reruns only filter and
+    apply the clock-dependent status overrides (add_live_status).
+    The loaders are deliberately uncached: this is the only cache layer,
+    so a new version key always re-reads the source.
+    """
+    if source.startswith(("http://", "https://")):
+        raw_df = fetch_json_from_github(source, int(version))
     else:
-        raw_df = load_local_json(JSON_PATH)
-        data_source = "Local file"
-except Exception as e:
-    st.error(f"Failed to load data: {e}")
-    st.stop()
+        raw_df = load_events(source)
+
+    # Low-cardinality keys → category (groupby / dedupe on int codes)
+    for col in ("user_id", "event", "name"):
+        if col in raw_df.columns:
+            raw_df[col] = raw_df[col].astype("category")
+    # Free text → Arrow strings (str.contains runs on Arrow kernels)
+    if "note" in raw_df.columns:
+        raw_df["note"] = raw_df["note"].astype("string[pyarrow]")
+
+    df = parse_datetime_columns(raw_df)
+    # Narrow to the fields used below before sorting (the sort copies every column)
+    df = df[[c for c in TRANSFORM_INPUTS if c in df.columns]]
+    # Ascending → window bounds via searchsorted; views reverse for display
+    df = df.sort_values("datetime", ignore_index=True)
+
+    # Format off the naive IST wall-clock values (tz-aware strftime is much slower)
+    naive_ist = df["datetime"].dt.tz_localize(None)
+    # Date: strftime once per distinct calendar day, then gather by code
+    days = naive_ist.values.astype("datetime64[D]")
+    uniq_days, day_codes = np.unique(days, return_inverse=True)
+    df["Date"] = pd.Categorical.from_codes(
+        day_codes, categories=pd.DatetimeIndex(uniq_days).strftime("%d-%m-%Y")
+    )
+    df["Time"] = naive_ist.dt.strftime("%H:%M:%S").astype("string[pyarrow]")
+
+    # Vectorized status (same precedence as the old per-row if-chain).
+    # Only the clock-independent part is cached here; the stale-session and
+    # "today" overrides run per rerun in add_live_status().
+    evt = df["event"]
+    dt = df["datetime"]
+    is_punch_out = (evt == "Punch Out").to_numpy()  # code compare on the categorical
+
+    # Last Punch Out per user (for the stale-session check)
+    df["last_out"] = (
+        dt.where(is_punch_out)
+        .groupby(df["user_id"], observed=True)
+        .transform("max")
+    )
 
-# -----------------------------
-# TRANSFORM
-# -----------------------------
-df = parse_datetime_columns(raw_df)
-df = df.sort_values("datetime", ascending=False).copy()
+    if "note" in df.columns:
+        note_left = df["note"].str.contains(
+            "left for the day", case=False, na=False, regex=False
+        ).to_numpy(dtype=bool)
+    else:
+        note_left = np.zeros(len(df), dtype=bool)
 
-df["datetime_ist"] = df["datetime"]
-df["Date"] = df["datetime_ist"].dt.strftime("%d-%m-%Y")
-df["Time"] = df["datetime_ist"].dt.strftime("%H:%M:%S")
+    # NORMAL STATUS: per-event lookup (Series.map → one gather per category)
+    status = evt.map(STATUS_MAP).to_numpy(dtype=object, na_value="⚪ unknown")
+    status = np.where(is_punch_out & note_left, "🟡 left for the day", status)
+    df["status"] = pd.Categorical(status)
 
-# Last punch-out per user
-last_punch_out = (
-    df[df["event"] == "Punch Out"]
-    .groupby("user_id")["datetime"]
-    .max()
-)
+    # WORK MODE (KNOWN GOOD LOGIC)
+    # One nullable-boolean cast, then two plain numpy masks
+    if "is_at_approved_location" in df.columns:
+        approved = df["is_at_approved_location"].astype("boolean")
+    else:
+        approved = pd.Series(pd.NA, index=df.index, dtype="boolean")
+    is_unknown = approved.isna().to_numpy()
+    in_office = approved.to_numpy(dtype=bool, na_value=False)
+    df["Work mode"] = pd.Categorical(np.where(
+        is_unknown,
+        "Unknown",
+        np.where(in_office, "In Office", "Work from home"),
+    ))
+
+    # Footer: last event time
+    sort_key = raw_df.get("sort_key")
+    if sort_key is not None and isinstance(sort_key.dtype, pd.DatetimeTZDtype):
+        last_ist = sort_key.max().tz_convert(IST_TZ)
+    elif sort_key is not None:
+        # ISO8601 keys sort chronologically → take the string max, parse one scalar
+        last_key = sort_key.dropna().max()
+        last_ist = pd.to_datetime(last_key, errors="coerce", utc=True).tz_convert(IST_TZ)
+    else:
+        last_ist = df["datetime"].max()
 
-_now_ist = pd.Timestamp.now(tz=IST_TZ)
-_today_ist_date = _now_ist.floor("D").date()
+    # Only what reruns touch → smaller pickle on every cache hit
+    return df[[c for c in VIEW_COLUMNS if c in df.columns]], last_ist
 
-ACTIVE_EVENTS = {"Punch In", "Break Start", "Break End"}
 
-def map_display_status(row) -> str:
-    evt = str(row.get("event", ""))
-    dt = row.get("datetime_ist")
-    note = str(row.get("note", "")).lower()
-    user_id = row.get("user_id")
+def add_live_status(view: pd.DataFrame, now_ist: pd.Timestamp) -> pd.DataFrame:
+    """
+    Clock-dependent status overrides + "Name & Status" for the shown rows
+    (per rerun, so stale hours and "today" never lag the cached frame)
+    """
+    evt = view["event"]
+    dt = view["datetime"]
+    status = view["status"].to_numpy(dtype=object)
+
+    # Punch Out today → left for the day (bounds on the raw UTC buffer)
+    today_start = now_ist.floor("D")
+    vals = dt.values
+    is_today = (vals >= today_start.to_datetime64()) & (
+        vals < (today_start + pd.Timedelta(days=1)).to_datetime64()
+    )
+    status = np.where(
+        (evt == "Punch Out").to_numpy() & is_today, "🟡 left for the day", status
+    )
 
     # 🔴 STALE SESSION CHECK (>12h, no Punch Out after)
-    if evt in ACTIVE_EVENTS and pd.notna(dt):
-        hours_open = (_now_ist - dt).total_seconds() / 3600
-        last_out = last_punch_out.get(user_id)
-
-        if hours_open >= MAX_ONLINE_HOURS and (
-            last_out is None or last_out <= dt
-        ):
-            return f"🔴 no punch out ({int(hours_open)}h+)"
-
-    # NORMAL STATUS
-    if evt == "Punch In":
-        return "🟢 active"
-    if evt == "Break Start":
-        return "🟠 on break"
-    if evt == "Break End":
-        return "🟢 active"
-    if evt == "Punch Out":
-        if "left for the day" in note or dt.date() == _today_ist_date:
-            return "🟡 left for the day"
-        return "🔴 on leave"
-    if evt == "On Leave":
-        return "🔴 on leave"
-
-    return "⚪ unknown"
-
-df["status"] = df.apply(map_display_status, axis=1)
-df["Name & Status"] = df.apply(
-    lambda r: f"{r.get('name','')} {r['status']}", axis=1
-)
+    hours_open = (now_ist - dt).dt.total_seconds() / 3600
+    last_out = view["last_out"]
+    stale = (
+        evt.isin(ACTIVE_EVENTS)
+        & (hours_open >= MAX_ONLINE_HOURS)
+        & (last_out.isna() | (last_out <= dt))
+    ).to_numpy()
+    # Stale label formatted only for the stale rows
+    status[stale] = (
+        "🔴 no punch out (" + hours_open[stale].astype(int).astype(str) + "h+)"
+    ).to_numpy(dtype=object)
+
+    # Arrow-backed → vectorized concat, no per-render copy into Arrow IPC
+    if "name" in view.columns:
+        names = view["name"].astype("string[pyarrow]").fillna("")
+    else:
+        names = pd.Series("", index=view.index, dtype="string[pyarrow]")
+    status = pd.Series(status, index=view.index, dtype="string[pyarrow]")
+    return view.assign(**{"Name & Status": names.str.cat(status, sep=" ")})
 
 # -----------------------------
-# WORK MODE (KNOWN GOOD LOGIC)
+# LOAD DATA
 # -----------------------------
-def map_work_mode(val):
-    if pd.isna(val) or val is None:
-        return "Unknown"
-    return "In Office" if bool(val) else "Work from home"
-
-if "is_at_approved_location" not in df.columns:
-    df["is_at_approved_location"] = None
+try:
+    if GITHUB_RAW_URL:
+        source, version = GITHUB_RAW_URL, int(time() // CACHE_TTL_SEC)
+        data_source = "GitHub Raw"
+    else:
+        source = JSON_PATH
+        version = os.path.getmtime(JSON_PATH) if os.path.exists(JSON_PATH) else 0.0
+        data_source = "Local file"
+    df, last_ist = build_df(source, version)
+except Exception as e:
+    st.error(f"Failed to load data: {e}")
+    st.stop()
 
-df["Work mode"] = df["is_at_approved_location"].apply(map_work_mode)
+# One clock reading per rerun → window and statuses agree on "today"
+now_ist = pd.Timestamp.now(tz=IST_TZ)
 
 # -----------------------------
 # WINDOW FILTER
 # -----------------------------
 window_info = ""
 if SHOW_WINDOW:
-    df, start_d, end_d = apply_window(df)
+    df, start_d, end_d = apply_window(df, now_ist.date().isoformat())
     window_info = f" (window: {start_d:%d-%m-%Y} → {end_d:%d-%m-%Y})"
 
 # -----------------------------
@@ -209,13 +383,11 @@ view_mode = st.sidebar.radio(
 )
 
 if view_mode == "Latest per user":
-    df_view = (
-        df.sort_values("datetime", ascending=False)
-        .drop_duplicates(subset=["user_id"], keep="first")
-        .sort_values("datetime", ascending=False)
-    )
+    df_view = latest_per_user(df)
 else:
-    df_view = df
+    df_view = df.iloc[::-1]
+
+df_view = add_live_status(df_view, now_ist)
 
 # -----------------------------
 # UI
@@ -233,15 +405,6 @@ st.dataframe(
 )
 
 # Footer
-if "sort_key" in raw_df.columns:
-    last_ist = (
-        pd.to_datetime(raw_df["sort_key"], errors="coerce", utc=True)
-        .dt.tz_convert(IST_TZ)
-        .max()
-    )
-else:
-    last_ist = df["datetime_ist"].max()
-
 st.caption(
     f"Data last event time (IST): **{last_ist}** · Data source: {data_source}"
 )
\ No newline at end of file